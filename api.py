@@ -0,0 +1,182 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from helper import write_log_file, MAPPING_EXPORT_HEADER
+
+# Local read-only HTTP/JSON API over the PluIndex of SaveDataToTXT.
+# Imported from save.py only when the API is enabled in config.json.
+
+MAX_BODY_SIZE = 1024 * 1024
+MAX_LOOKUP_KEYS = 50000
+LOOKUP_KEYS = ("code", "plu", "articul")
+
+
+def row_to_dict(row: tuple) -> dict:
+    return dict(zip(MAPPING_EXPORT_HEADER, row))
+
+
+def lookup(index, query: dict) -> dict:
+    """
+    Find published PLUs by item codes, PLU numbers and articuls.
+
+    Args:
+        index (PluIndex): Index snapshot to search in
+        query (dict): {"code": [...], "plu": [...], "articul": [...]}, every key is optional
+
+    Returns:
+        dict: {"items": [...], "not_found": {"code": [...], "plu": [...], "articul": [...]}}
+
+    Raises:
+        ValueError: If the query is malformed
+    """
+    if not isinstance(query, dict):
+        raise ValueError("expected a JSON object")
+
+    unknown = set(query) - set(LOOKUP_KEYS)
+    if unknown:
+        raise ValueError(f"unknown keys: {', '.join(sorted(unknown))}")
+
+    if sum(len(values) for values in query.values() if isinstance(values, list)) > MAX_LOOKUP_KEYS:
+        raise ValueError(f"too many keys, maximum is {MAX_LOOKUP_KEYS}")
+
+    items = []
+    not_found = {}
+    for key in LOOKUP_KEYS:
+        values = query.get(key, [])
+        if not isinstance(values, list):
+            raise ValueError(f"'{key}' must be a list")
+
+        for value in values:
+            if key == "articul":
+                found = index.by_articul.get(str(value).strip(), [])
+            else:
+                try:
+                    number = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"'{key}' values must be integers, got {value!r}")
+                index_dict = index.by_code if key == "code" else index.by_plu
+                row = index_dict.get(number)
+                found = [row] if row else []
+
+            if found:
+                items.extend(row_to_dict(row) for row in found)
+            else:
+                not_found.setdefault(key, []).append(value)
+
+    return {"items": items, "not_found": not_found}
+
+
+def status(index) -> dict:
+    return {
+        "updated": index.updated,
+        "plu_count": len(index.rows),
+        "scales": index.scales_statuses,
+    }
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    # Set by ApiServer: callable returning the current PluIndex
+    get_index = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/status":
+            self.send_json(200, status(self.get_index()))
+        elif url.path == "/lookup":
+            params = parse_qs(url.query)
+            query = {key: [value for values in params[key] for value in values.split(",") if value]
+                     for key in params}
+            self.handle_lookup(query)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/lookup":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= MAX_BODY_SIZE:
+            self.send_json(400, {"error": f"body must be between 1 and {MAX_BODY_SIZE} bytes"})
+            return
+
+        try:
+            query = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.send_json(400, {"error": f"invalid JSON: {e}"})
+            return
+        self.handle_lookup(query)
+
+    def handle_lookup(self, query):
+        try:
+            result = lookup(self.get_index(), query)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+        else:
+            self.send_json(200, result)
+
+    def send_json(self, code: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests aren't logged, the log file is kept for the sync
+        pass
+
+
+class ApiServer:
+    """
+    HTTP server in a daemon thread. Handlers read save_data.index, which is replaced as a whole
+    after every save, so serving requests never waits for the sync and the sync never waits for them.
+    """
+    def __init__(self, save_data, host: str, port: int):
+        self.host = host
+        self.port = port
+        handler = type("BoundApiRequestHandler", (ApiRequestHandler,),
+                       {"get_index": staticmethod(lambda: save_data.index)})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="plu-api", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        write_log_file(f"API is listening on http://{self.host}:{self.port}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        write_log_file(f"API on http://{self.host}:{self.port} was stopped")
+
+
+def update_api_server(api_server: ApiServer | None, settings, save_data) -> ApiServer | None:
+    """
+    Start, stop or restart the API according to settings.api.
+
+    Returns:
+        ApiServer | None: Running server or None if the API is disabled or couldn't start
+    """
+    api = settings.api
+    if api_server and api["active"] and (api_server.host, api_server.port) == (api["host"], api["port"]):
+        return api_server
+
+    if api_server:
+        api_server.stop()
+    if not api["active"]:
+        return None
+
+    try:
+        api_server = ApiServer(save_data, api["host"], api["port"])
+    except OSError as e:
+        write_log_file(f"Error starting API on {api['host']}:{api['port']}: {e}")
+        return None
+    api_server.start()
+    return api_server
@@ -0,0 +1,48 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from helper import write_tuples_to_excel, write_rows_to_xlsx, write_rows_to_csv, MAPPING_EXPORT_HEADER
+
+# Compare write_tuples_to_excel with the streaming exports on a catalog of the given size.
+# Usage: python bench_export.py --rows 20000
+
+
+def make_rows(count):
+    return [(plu, 100000 + plu, str(plu) if plu % 3 else None, f"Товар весовой {plu}", plu * 1.25, plu % 2)
+            for plu in range(1, count + 1)]
+
+
+def bench(name, function, rows, filename):
+    started = time.perf_counter()
+    function(filename)
+    elapsed = time.perf_counter() - started
+
+    # Separate run for memory, tracemalloc slows the code down too much to time it
+    tracemalloc.start()
+    function(filename)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:24} {elapsed:8.2f} s {len(rows) / elapsed:12.0f} rows/s {peak / 1024 / 1024:8.1f} MB peak "
+          f"{os.path.getsize(filename) / 1024:10.0f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PLU export functions.")
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    with tempfile.TemporaryDirectory() as directory:
+        bench("write_tuples_to_excel", lambda filename: write_tuples_to_excel([MAPPING_EXPORT_HEADER] + rows, filename),
+              rows, os.path.join(directory, "tuples.xlsx"))
+        bench("write_rows_to_xlsx", lambda filename: write_rows_to_xlsx(rows, filename, header=MAPPING_EXPORT_HEADER),
+              rows, os.path.join(directory, "rows.xlsx"))
+        bench("write_rows_to_csv", lambda filename: write_rows_to_csv(rows, filename, header=MAPPING_EXPORT_HEADER),
+              rows, os.path.join(directory, "rows.csv"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,13 @@
 import json
 import os
 from datetime import datetime
+from decimal import Decimal
 import configparser
 import sys
-import win32api
 import glob
-import subprocess
-import platform
-import openpyxl
+import csv
+from collections import namedtuple
+from types import MappingProxyType
 
 DEFAULT_CONFIG = {
     "host": "localhost",
@@ -37,8 +37,16 @@ DEFAULT_CONFIG = {
             "type": 1, # Весовой: 0, штучный: 1
         },
     ],
+    "api": {
+        "active": False,
+        "host": "127.0.0.1",
+        "port": 8765,
+    },
 }
 
+# Keys that may be absent in config.json created by older versions, DEFAULT_CONFIG values are used for them
+OPTIONAL_SETTINGS = ("api",)
+
 README_CONTENT = """
 Программа для загрузки PLU из Regos (firebird база данных) в файл. Загружает только новые или изменённые товары.
 # Руководство по настройке конфигурации
@@ -83,10 +91,39 @@ README_CONTENT = """
    - `id`: 1 - Посмотреть код единицы измерения в программе Regos.
    - `type`: 1 (1 соответствует штучному товару)
 
+### Локальный API
+- `api` - HTTP/JSON API для поиска PLU, назначенных товарам на весах (по умолчанию выключен):
+   - `active`: true - включить API
+   - `host`: "127.0.0.1" - адрес, на котором API принимает запросы (только этот компьютер)
+   - `port`: 8765 - порт
+
+Запросы:
+- `GET /lookup?code=1001,1002&plu=15&articul=77` - поиск по коду товара, PLU или артикулу
+- `POST /lookup` с JSON `{"code": [...], "plu": [...], "articul": [...]}` - массовый поиск
+- `GET /status` - время последней выгрузки и состояние каждых весов
+
 ## Как изменить конфигурацию
 
 Для изменения настроек отредактируйте файл конфигурации, сохраняя его структуру и формат JSON. 
-После внесения изменений перезапустите приложение для применения новых настроек.
+Перезапуск приложения не требуется: файл проверяется на изменения при каждом цикле проверки.
+- `check_time` и `only_changed_items` применяются сразу.
+- Изменение `api` перезапускает локальный API.
+- Изменение параметров подключения (`host`, `database`, `user`, `password`) приводит к переподключению к базе.
+При смене `host` или `database` номера PLU назначаются заново и файлы весов полностью перезаписываются.
+- Изменение параметров, влияющих на файлы PLU (`price_type`, `divider_price`, `units`, `use_articul`, 
+`handle_big_price`, `plu_file_path`, `scales_config_path`), приводит к полной перезаписи файлов весов 
+с сохранением уже назначенных номеров PLU.
+- Если файл содержит ошибку, она записывается в лог, а программа продолжает работать со старыми настройками.
+
+## Параметры запуска
+- `--startup-profile` - записать в лог время импорта каждого модуля и время до первой завершённой синхронизации.
+Используется для отслеживания скорости запуска.
+
+## Выгрузка PLU для печати ценников
+Чтобы выгрузить текущее соответствие код товара -> PLU -> артикул, создайте файл `export.request`
+в папке программы. Файл может содержать путь к файлу выгрузки (.xlsx или .csv), иначе выгрузка
+сохраняется в папку `exports`. Выгрузка выполняется в фоне и не останавливает загрузку PLU на весы,
+файл `export.request` удаляется после обработки.
 
 ## Примечания
 - Все пути к файлам должны быть указаны в полном формате
@@ -96,15 +133,26 @@ README_CONTENT = """
 Запустите файл от имени администратора.
 """
 
-today = datetime.now().strftime("%d-%m-%Y")
-log_file = f"logs/log-{today}.log"
-os.makedirs(os.path.dirname(log_file), exist_ok=True)
+log_file = None
+
+def init_logging(log_dir="logs"):
+    """
+    Create the log folder and choose today's log file. Called from main,
+    write_log_file calls it itself if something is logged before that.
+    """
+    global log_file
+    today = datetime.now().strftime("%d-%m-%Y")
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, f"log-{today}.log")
+    return log_file
 
 def get_date():
     now = datetime.now()
     return now.strftime("%m/%d/%Y %H:%M:%S")
 
 def write_log_file(text):
+    if log_file is None:
+        init_logging()
     with open(log_file, "a", encoding='utf-8') as file:
         formatted_text = f"{get_date()} - {text}\n"
         file.write(formatted_text)
@@ -136,6 +184,158 @@ def configure_settings(data_dict=DEFAULT_CONFIG, filename="config.json"):
     else:
         return data_dict
 
+
+# Settings that require reconnecting to the Firebird.
+CONNECTION_SETTINGS = frozenset({"host", "database", "user", "password"})
+# Settings that point to another database, sync state and assigned PLUs are dropped and the files rewritten.
+DATABASE_SETTINGS = frozenset({"host", "database"})
+# Settings that change the content of the PLU files and require rewriting them.
+OUTPUT_SETTINGS = frozenset({"price_type", "divider_price", "units", "use_articul", "handle_big_price",
+                             "plu_file_path", "scales_config_path"})
+
+
+# namedtuple instead of a frozen dataclass: dataclasses imports inspect, which slows down the start
+class Settings(namedtuple("Settings", [
+    "host", "database", "user", "password", "price_type", "check_time", "divider_price", "use_articul",
+    "plu_file_path", "scales_config_path", "only_changed_items", "handle_big_price", "units", "units_dict", "api",
+])):
+    """
+    Validated, read-only copy of config.json.
+    A new instance is created on every reload, so an object passed to SaveDataToTXT never changes.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, config: dict) -> "Settings":
+        """
+        Validate a config dictionary and build Settings from it.
+
+        Args:
+            config (dict): Dictionary loaded from config.json
+
+        Returns:
+            Settings: Validated settings
+
+        Raises:
+            ValueError: If a key is missing or has an invalid value
+        """
+        if not isinstance(config, dict):
+            raise ValueError("expected a JSON object")
+
+        missing = [key for key in DEFAULT_CONFIG if key not in config and key not in OPTIONAL_SETTINGS]
+        if missing:
+            raise ValueError(f"missing keys: {', '.join(missing)}")
+
+        for key in ("host", "database", "user", "password", "plu_file_path", "scales_config_path"):
+            if not isinstance(config[key], str):
+                raise ValueError(f"'{key}' must be a string")
+
+        for key in ("use_articul", "only_changed_items"):
+            if not isinstance(config[key], bool):
+                raise ValueError(f"'{key}' must be true or false")
+
+        if not isinstance(config["price_type"], int) or isinstance(config["price_type"], bool):
+            raise ValueError("'price_type' must be an integer")
+
+        for key in ("check_time", "divider_price"):
+            value = config[key]
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                raise ValueError(f"'{key}' must be a positive number")
+
+        big_price = config["handle_big_price"]
+        if not isinstance(big_price, dict) or not isinstance(big_price.get("active"), bool):
+            raise ValueError("'handle_big_price.active' must be true or false")
+        divider = big_price.get("divider")
+        if not isinstance(divider, (int, float)) or isinstance(divider, bool) or divider <= 0:
+            raise ValueError("'handle_big_price.divider' must be a positive number")
+
+        units = config["units"]
+        if not isinstance(units, list) or not units:
+            raise ValueError("'units' must be a non-empty list")
+        for unit in units:
+            if not isinstance(unit, dict) or not isinstance(unit.get("id"), int) or unit.get("type") not in (0, 1):
+                raise ValueError(f"invalid unit {unit!r}, expected 'id' (integer) and 'type' (0 or 1)")
+
+        api = config.get("api", DEFAULT_CONFIG["api"])
+        if not isinstance(api, dict) or not isinstance(api.get("active"), bool):
+            raise ValueError("'api.active' must be true or false")
+        if not isinstance(api.get("host"), str):
+            raise ValueError("'api.host' must be a string")
+        port = api.get("port")
+        if not isinstance(port, int) or isinstance(port, bool) or not 0 < port < 65536:
+            raise ValueError("'api.port' must be a port number")
+
+        frozen_units = tuple(MappingProxyType(dict(unit)) for unit in units)
+        return cls(
+            host=config["host"],
+            database=config["database"],
+            user=config["user"],
+            password=config["password"],
+            price_type=config["price_type"],
+            check_time=config["check_time"],
+            divider_price=config["divider_price"],
+            use_articul=config["use_articul"],
+            plu_file_path=config["plu_file_path"],
+            scales_config_path=config["scales_config_path"],
+            only_changed_items=config["only_changed_items"],
+            handle_big_price=MappingProxyType(dict(big_price)),
+            units=frozen_units,
+            units_dict=MappingProxyType(get_units_type(units=frozen_units)),
+            api=MappingProxyType(dict(api)),
+        )
+
+
+def changed_settings(old: Settings, new: Settings) -> set:
+    """
+    Return names of the config keys whose values differ between two Settings objects.
+    """
+    return {name for name in Settings._fields
+            if name != "units_dict" and getattr(old, name) != getattr(new, name)}
+
+
+class ConfigWatcher:
+    """
+    Watch config.json by modification time and reload it into Settings.
+    Unlike configure_settings, a broken file is never deleted or overwritten here: the error is logged
+    and the previous settings stay in use until the file is fixed.
+    """
+    def __init__(self, settings: Settings, filename="config.json"):
+        self.filename = filename
+        self.settings = settings
+        self.mtime = self.get_mtime()
+
+    def get_mtime(self):
+        try:
+            return os.stat(self.filename).st_mtime_ns
+        except OSError:
+            return None
+
+    def poll(self) -> Settings | None:
+        """
+        Check config.json for changes.
+
+        Returns:
+            Settings | None: New settings if the file was changed and is valid, otherwise None
+        """
+        mtime = self.get_mtime()
+        if mtime is None or mtime == self.mtime:
+            return None
+        self.mtime = mtime
+
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as json_file:
+                settings = Settings.from_dict(json.load(json_file))
+        except (OSError, ValueError) as e:
+            # json.JSONDecodeError is a subclass of ValueError
+            write_log_file(f"Error reloading '{self.filename}': {e}. Previous settings are kept.")
+            return None
+
+        if settings == self.settings:
+            return None
+        self.settings = settings
+        return settings
+
+
 def int_to_ip(ip_int):
     """
     Convert a signed 32-bit integer to an IP address string
@@ -213,6 +413,15 @@ def create_arg_query(units_data: list, latest_changes: dict | None, only_changed
     return sql_args
 
 
+def divide_price(price, divider):
+    """
+    Divide a price from the database by a divider from config.json.
+    NUMERIC prices come from fdb as Decimal, which can't be divided by a float divider.
+    """
+    if isinstance(price, Decimal):
+        return price / Decimal(str(divider))
+    return price / divider
+
 def get_units_type(units: list):
     units_dict = {}
     for unit_info in units:
@@ -261,6 +470,7 @@ def combine_plu_lists(old_plu_data_list: list, new_plu_data_list: list, articul_
 
 def get_short_path_name(path):
     try:
+        import win32api
         return win32api.GetShortPathName(path)
     except Exception as e:
         write_log_file(f"Error getting short path name: {e}")
@@ -349,6 +559,9 @@ def ping_device(ip_address, count=3, timeout=2):
     Returns:
         bool: True if device responds to ping, False otherwise
     """
+    import platform
+    import subprocess
+
     # Determine the ping command based on the operating system
     param = '-n' if platform.system().lower() == 'windows' else '-c'
     timeout_param = '-w' if platform.system().lower() == 'windows' else '-W'
@@ -378,6 +591,8 @@ def write_tuples_to_excel(tuples_list, filename='output.xlsx', sheet_name='Sheet
     Returns:
     - str: Path to the created Excel file
     """
+    import openpyxl
+
     # Create a new workbook and select the active sheet
     workbook = openpyxl.Workbook()
     sheet = workbook.active
@@ -394,3 +609,116 @@ def write_tuples_to_excel(tuples_list, filename='output.xlsx', sheet_name='Sheet
     return filename
 
 
+MAPPING_EXPORT_HEADER = ("plu", "code", "articul", "name", "price", "unit_type")
+
+
+def write_rows_to_xlsx(rows, filename='output.xlsx', sheet_name='Sheet1', header=None):
+    """
+    Stream rows to an Excel file using openpyxl write-only mode.
+    Rows are written one by one instead of keeping every cell in memory as write_tuples_to_excel does.
+
+    Parameters:
+    - rows (iterable): Rows (tuples or lists) to be written
+    - filename (str, optional): Name of the Excel file to create. Defaults to 'output.xlsx'
+    - sheet_name (str, optional): Name of the worksheet. Defaults to 'Sheet1'
+    - header (tuple, optional): First row with column names. Defaults to None
+
+    Returns:
+    - str: Path to the created Excel file
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name)
+    if header:
+        sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+
+    workbook.save(filename)
+
+    return filename
+
+
+def write_rows_to_csv(rows, filename='output.csv', header=None, delimiter=';'):
+    """
+    Write rows to a CSV file. Encoded as UTF-8 with BOM so Excel shows cyrillic names correctly.
+
+    Parameters:
+    - rows (iterable): Rows (tuples or lists) to be written
+    - filename (str, optional): Name of the CSV file to create. Defaults to 'output.csv'
+    - header (tuple, optional): First row with column names. Defaults to None
+    - delimiter (str, optional): Column delimiter. Defaults to ';'
+
+    Returns:
+    - str: Path to the created CSV file
+    """
+    with open(filename, 'w', encoding='utf-8-sig', newline='') as csv_file:
+        writer = csv.writer(csv_file, delimiter=delimiter)
+        if header:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+    return filename
+
+
+def export_rows(rows, filename, header=None):
+    """
+    Write rows to a .csv or .xlsx file depending on the file extension.
+
+    Returns:
+    - str: Path to the created file
+    """
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if filename.lower().endswith(".csv"):
+        return write_rows_to_csv(rows, filename, header=header)
+    return write_rows_to_xlsx(rows, filename, sheet_name="PLU", header=header)
+
+
+def read_export_request(request_path="export.request", export_dir="exports"):
+    """
+    Check whether an export of the PLU mapping was requested.
+    The request is an 'export.request' file next to the program. It may contain the path of the
+    file to create (.xlsx or .csv), otherwise the export is saved into the exports folder.
+    The request file is removed after it was read.
+
+    Returns:
+    - str | None: Path of the file to export to, None if there's no request
+    """
+    if not os.path.exists(request_path):
+        return None
+
+    try:
+        with open(request_path, 'r', encoding='utf-8') as request_file:
+            filename = request_file.read().strip()
+        os.remove(request_path)
+    except Exception as e:
+        write_log_file(f"Error reading export request '{request_path}': {e}")
+        return None
+
+    if not filename:
+        filename = os.path.join(export_dir, f"plu-{datetime.now().strftime('%d-%m-%Y-%H-%M-%S')}.xlsx")
+    return filename
+
+
+class PluIndex:
+    """
+    Read-only snapshot of the published PLUs and scale statuses with lookups by code, PLU and articul.
+    SaveDataToTXT builds a new index after every save and replaces the old one, an index is never
+    changed after creation, so other threads (exports, the local API) can read it without locks.
+    """
+    def __init__(self, rows: tuple = (), scales_statuses: dict | None = None, updated: str | None = None):
+        self.rows = rows
+        self.scales_statuses = {ip: dict(status) for ip, status in (scales_statuses or {}).items()}
+        self.updated = updated
+        self.by_code = {}
+        self.by_plu = {}
+        self.by_articul = {}
+        for row in rows:
+            self.by_code[row[1]] = row
+            self.by_plu[row[0]] = row
+            if row[2] is not None:
+                self.by_articul.setdefault(str(row[2]).strip(), []).append(row)
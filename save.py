@@ -1,34 +1,37 @@
-import fdb
+import sys
 import time
+
+# The profile has to be started before the other imports to measure them
+if "--startup-profile" in sys.argv:
+    from startup_profile import StartupProfile
+    startup_profile = StartupProfile()
+    startup_profile.start()
+else:
+    startup_profile = None
+
+import argparse
 import os
+import threading
+import fdb
 
-from helper import configure_settings, write_log_file, get_units_type, extract_ip_addresses_from_ini_and_create_path, \
+from helper import init_logging, configure_settings, write_log_file, extract_ip_addresses_from_ini_and_create_path, \
     combine_plu_lists, find_available_plu_numbers, create_arg_query, get_short_path_name, save_readme_if_not_exists, \
-    delete_txt_files
+    delete_txt_files, divide_price, export_rows, read_export_request, get_date, MAPPING_EXPORT_HEADER, PluIndex, \
+    Settings, ConfigWatcher, changed_settings, CONNECTION_SETTINGS, DATABASE_SETTINGS, \
+    OUTPUT_SETTINGS
 
 # pyinstaller command: pyinstaller --onefile --name=ShtrixPrintPluAutoSaver save.py
 
-config = configure_settings()
-price_type = config["price_type"]
-host = config["host"]
-database = config["database"]
-user = config["user"]
-password = config["password"]
-divider_price = config["divider_price"]
-units = config["units"]
-use_articul = config["use_articul"]
-plu_file_path = config["plu_file_path"]
-check_time = config["check_time"]
-scales_config_path = config["scales_config_path"]
-units_dict = get_units_type(units=units)
-only_changed_items = config["only_changed_items"]
-handle_big_price = config["handle_big_price"]
+# Seconds before a scale whose file couldn't be written gets a full file again, doubled after every failure
+SCALE_RETRY_MIN_DELAY = 30
+SCALE_RETRY_MAX_DELAY = 900
 
 class SaveDataToTXT:
-    def __init__(self):
+    def __init__(self, settings: Settings):
+        self.settings = settings
         self.fdb_conn = None
         self.last_sync = 0
-        self.path = get_short_path_name(database)
+        self.path = get_short_path_name(settings.database)
         self.connection_status = False
         self.last_change_dict = {}
         self.last_changes_timestamp = 0
@@ -36,17 +39,57 @@ class SaveDataToTXT:
         self.temp_articul_dict = {}
         self.scales_ips = {}
         self.scales_statuses = {}
-        os.makedirs(plu_file_path, exist_ok=True)
+        self.recompute_pending = False
+        self.last_published = {}
+        # Snapshot of the published PLUs for exports and the local API, replaced after every save
+        self.index = PluIndex()
+        self.export_thread = None
+        # ip: {"delay": seconds, "retry_at": time.monotonic()} of scales whose file couldn't be written
+        self.failed_scales = {}
+        os.makedirs(settings.plu_file_path, exist_ok=True)
         save_readme_if_not_exists()
-        delete_txt_files(plu_file_path)
+        delete_txt_files(settings.plu_file_path)
+
+    def apply_settings(self, settings: Settings):
+        """
+        Switch to reloaded settings without restarting.
+        Connection changes close the current connection so the main loop reconnects,
+        switching to another database also drops its sync state and assigned PLUs,
+        output changes schedule a full rewrite of the PLU files keeping already assigned PLUs.
+        """
+        changed = changed_settings(self.settings, settings)
+        self.settings = settings
+        if not changed:
+            return
+
+        write_log_file(f"Config reloaded, changed: {', '.join(sorted(changed))}")
+        if changed & CONNECTION_SETTINGS:
+            self.path = get_short_path_name(settings.database)
+            self.close_fdb()
+
+        if changed & DATABASE_SETTINGS:
+            # Sync state and assigned PLUs belong to the old database, start over as after a restart
+            self.last_sync = 0
+            self.last_changes_timestamp = 0
+            self.last_change_dict = {}
+            self.used_plus = {}
+            self.temp_articul_dict = {}
+            self.last_published = {}
+            self.recompute_pending = True
+
+        if changed & OUTPUT_SETTINGS:
+            os.makedirs(settings.plu_file_path, exist_ok=True)
+            # Paths of the scales depend on plu_file_path, they are extracted again on the next save
+            self.scales_ips = {}
+            self.recompute_pending = True
 
     def connect_fdb(self):
         try:
             self.fdb_conn = fdb.connect(
-                host=host,
+                host=self.settings.host,
                 database=self.path,
-                user=user,
-                password=password,
+                user=self.settings.user,
+                password=self.settings.password,
                 charset='utf-8',
             )
         except fdb.fbcore.DatabaseError:
@@ -58,6 +101,15 @@ class SaveDataToTXT:
             write_log_file("Connected to the Firebird.")
             return True
 
+    def close_fdb(self):
+        if self.fdb_conn is not None:
+            try:
+                self.fdb_conn.close()
+            except Exception as e:
+                write_log_file(f"Error: {e}")
+        self.fdb_conn = None
+        self.connection_status = False
+
     def check_cash_status(self) -> int:
         # 0: Didn't connect to fdb, 1: database changed, 2: connected, but database didn't change
         query_check_sync = """
@@ -128,10 +180,12 @@ class SaveDataToTXT:
 
 
     def fetch_items(self, fetch_all: bool = False):
+        units = self.settings.units
         if fetch_all:
             fetch_item_args = create_arg_query(units, self.last_change_dict, only_changed_items=False)
         else:
-            fetch_item_args = create_arg_query(units, self.last_change_dict, only_changed_items=only_changed_items)
+            fetch_item_args = create_arg_query(units, self.last_change_dict,
+                                               only_changed_items=self.settings.only_changed_items)
 
         query_fetch_items = f"""
         SELECT FIRST 22700 
@@ -154,7 +208,7 @@ class SaveDataToTXT:
         try:
             fdb_cursor = self.fdb_conn.cursor()
 
-            fdb_cursor.execute(query_fetch_items, (1, ))
+            fdb_cursor.execute(query_fetch_items, (self.settings.price_type, ))
             data = fdb_cursor.fetchall()
 
         except Exception as e:
@@ -207,11 +261,17 @@ class SaveDataToTXT:
             file.write(text)
 
     def format_data(self, fetch_all: bool = False):
+        settings = self.settings
+        use_articul = settings.use_articul
+        units_dict = settings.units_dict
+        divider_price = settings.divider_price
+        handle_big_price = settings.handle_big_price
         articuls_data = self.fetch_articuls_info() if use_articul else None
         if articuls_data and articuls_data != self.temp_articul_dict:
             self.temp_articul_dict = articuls_data
             self.last_change_dict = {}
             self.used_plus = {}
+            self.last_published = {}
             for scale_config in self.scales_ips.values():
                 scale_config["type"] = "new"
 
@@ -221,6 +281,13 @@ class SaveDataToTXT:
             return False
 
         plu_data = []
+        # (plu, code, articul, name, price, unit_type) of every line, used for exports and the local API
+        mapping_rows = []
+
+        def add_plu(plu, item, code, price, unit_type):
+            plu_data.append(f"{plu};{item[3]};;{price};0;0;0;{code};0;0;;01.01.01;{unit_type}")
+            mapping_rows.append((int(plu), int(code), item[2], item[3], float(price), unit_type))
+
         if use_articul and articuls_data:
             for key, value in articuls_data.items():
                 self.used_plus[value] = {"code": value, "plu": int(key), "is_articul": True}
@@ -231,17 +298,16 @@ class SaveDataToTXT:
             for item in data:
                 unit_type = units_dict.get(item[4])
                 code = item[1]
-                price = item[6] / divider_price
+                price = divide_price(item[6], divider_price)
 
                 if price >= 1000000:
                     if handle_big_price['active']:
-                        price = price / handle_big_price['divider']
+                        price = divide_price(price, handle_big_price['divider'])
                     else:
                         continue
 
                 if articuls_data and item[2] in articuls_data.keys():
-                    plu_data.append(
-                        f"{int(item[2])};{item[3]};;{price};0;0;0;{code};0;0;;01.01.01;{unit_type}")
+                    add_plu(int(item[2]), item, code, price, unit_type)
 
                 else:
                     # In this part of code there's no valid articul has been detected
@@ -249,13 +315,11 @@ class SaveDataToTXT:
                     used_plu_val = self.used_plus.get(code)
                     if used_plu_val and not used_plu_val["is_articul"]:
                         # PLU was uploaded before and wasn't articul
-                        plu_data.append(
-                            f"{used_plu_val['plu']};{item[3]};;{price};0;0;0;{code};0;0;;01.01.01;{unit_type}")
+                        add_plu(used_plu_val['plu'], item, code, price, unit_type)
 
                     else:
                         # PLU wasn't uploaded, it's purely new and not articul
-                        plu_data.append(
-                            f"{available_plu};{item[3]};;{price};0;0;0;{code};0;0;;01.01.01;{unit_type}")
+                        add_plu(available_plu, item, code, price, unit_type)
                         self.used_plus[code] = {"code": code, "plu": available_plu, "is_articul": False}
                         available_plu_pos += 1
 
@@ -266,49 +330,90 @@ class SaveDataToTXT:
             for item in data:
                 unit_type = units_dict.get(item[4])
                 code = item[1]
-                price = item[6] / divider_price
+                price = divide_price(item[6], divider_price)
                 if price >= 1000000:
                     if handle_big_price['active']:
-                        price = price / handle_big_price['divider']
+                        price = divide_price(price, handle_big_price['divider'])
                     else:
                         continue
                 available_plu = available_plu_list[available_plu_pos]
                 if code not in self.used_plus.keys():
-                    plu_data.append(
-                        f"{available_plu};{item[3]};;{price};0;0;0;{code};0;0;;01.01.01;{unit_type}")
+                    add_plu(available_plu, item, code, price, unit_type)
                     self.used_plus[code] = {"code": code, "plu": available_plu, "is_articul": False}
                     available_plu_pos += 1
 
                 else:
-                    plu_data.append(
-                        f"{self.used_plus[code]["plu"]};{item[3]};;{price};0;0;0;{code};0;0;;01.01.01;{unit_type}")
+                    add_plu(self.used_plus[code]["plu"], item, code, price, unit_type)
 
-        return plu_data
+        return plu_data, mapping_rows
 
     def save_to_txt(self):
+        # After an output setting was changed every item is fetched again and every file is rewritten
+        full_export = self.recompute_pending
+        only_changed_items = self.settings.only_changed_items
         last_changes = self.check_last_changes()
-        if not last_changes:
+        if not last_changes and not full_export:
             write_log_file(f"DB wasn't changed")
             return False
 
         extract_ip_addresses_from_ini_and_create_path(
-            ini_file_path=scales_config_path,
-            plu_file_path=plu_file_path,
+            ini_file_path=self.settings.scales_config_path,
+            plu_file_path=self.settings.plu_file_path,
             ip_addresses_dict=self.scales_ips,
         )
 
-        plu_data = self.format_data()
+        formatted = self.format_data(fetch_all=full_export)
+        if not formatted:
+            return False
+
+        plu_data, mapping_rows = formatted
         if not plu_data:
             return False
 
         string_data = "\n".join(plu_data)
 
-        for scale_config in self.scales_ips.values():
+        for ip, scale_config in self.scales_ips.items():
+            if ip in self.failed_scales and not full_export:
+                # Its file misses earlier changes, retry_failed_scales rewrites it from a full fetch
+                continue
+
             plu_path = scale_config["path"]
-            save_type = scale_config["type"]
-            if not os.path.exists(plu_path) or save_type == "new" or not only_changed_items:
-                write_log_file(f"{len(plu_data)} PLUs was saved into '{scale_config["path"]}'")
+            full = (not os.path.exists(plu_path) or scale_config["type"] == "new" or not only_changed_items
+                    or full_export)
+            self.save_scale(ip, plu_path, plu_data, string_data, full=full)
+
+        if last_changes:
+            self.last_change_dict["items"] = last_changes[0]
+            self.last_change_dict["prices"] = last_changes[1]
+
+        # Files were fully rewritten from this data, so items missing from it aren't on the scales anymore
+        self.update_mapping(mapping_rows, replace=full_export or not only_changed_items)
+        self.recompute_pending = False
+        return True
+
+    def save_scale(self, ip: str, plu_path: str, plu_data: list, string_data: str, full: bool) -> bool:
+        """
+        Save PLUs into the file of one scale and record the result in scales_statuses.
+        A scale whose file couldn't be written is added to failed_scales.
+
+        Args:
+            ip (str): IP address of the scale
+            plu_path (str): Path to the PLU file of the scale
+            plu_data (list): PLU lines to save
+            string_data (str): plu_data joined into the file content
+            full (bool): True to rewrite the file, False to merge plu_data into the old file
+
+        Returns:
+            bool: True if the file was saved
+        """
+        scale_status = self.scales_statuses.setdefault(ip, {"path": plu_path, "last_publish": None,
+                                                            "plu_count": 0, "error": None})
+        scale_status["path"] = plu_path
+        try:
+            if full:
+                write_log_file(f"{len(plu_data)} PLUs was saved into '{plu_path}'")
                 self.save_string_to_file(string_data, plu_path)
+                plu_count = len(plu_data)
 
             else:
                 with open(plu_path, 'r', encoding='windows-1251') as plu_file:
@@ -320,24 +425,162 @@ class SaveDataToTXT:
                 combined_string_data = "\n".join(combined_plu_data)
                 write_log_file(f"{len(combined_plu_data)} PLUs was added into '{plu_path}'. Old PLU file wasn't uploaded to the scale. Number of new PLUs is {new_item_q}")
                 self.save_string_to_file(combined_string_data, plu_path)
+                plu_count = len(combined_plu_data)
 
-        if last_changes:
-            self.last_change_dict["items"] = last_changes[0]
-            self.last_change_dict["prices"] = last_changes[1]
+        except Exception as e:
+            write_log_file(f"Error saving PLUs into '{plu_path}': {e}")
+            scale_status["error"] = str(e)
+            self.mark_scale_failed(ip)
+            return False
 
+        scale_status.update(last_publish=get_date(), plu_count=plu_count, error=None)
+        self.failed_scales.pop(ip, None)
         return True
 
+    def mark_scale_failed(self, ip: str):
+        # The delay doubles after every failed retry, so a scale that keeps failing doesn't cause a full fetch every poll
+        retry = self.failed_scales.get(ip)
+        delay = min(retry["delay"] * 2, SCALE_RETRY_MAX_DELAY) if retry else SCALE_RETRY_MIN_DELAY
+        self.failed_scales[ip] = {"delay": delay, "retry_at": time.monotonic() + delay}
+        write_log_file(f"PLU file of the scale {ip} will be fully rewritten in {delay} s")
+
+    def retry_failed_scales(self) -> bool:
+        """
+        Rewrite the files of failed scales whose retry delay passed from a full fetch.
+        Files of the other scales aren't touched.
+
+        Returns:
+            bool: True if a retry was made
+        """
+        now = time.monotonic()
+        due = [ip for ip, retry in self.failed_scales.items() if retry["retry_at"] <= now and ip in self.scales_ips]
+        if not due:
+            return False
+
+        formatted = self.format_data(fetch_all=True)
+        if not formatted or not formatted[0]:
+            return False
+
+        plu_data = formatted[0]
+        string_data = "\n".join(plu_data)
+        for ip in due:
+            self.save_scale(ip, self.scales_ips[ip]["path"], plu_data, string_data, full=True)
+
+        # Only the statuses changed, published PLUs of the index stay the same
+        self.index = PluIndex(self.index.rows, self.scales_statuses, updated=self.index.updated)
+        return True
+
+    def update_mapping(self, mapping_rows: list, replace: bool = False):
+        """
+        Remember published PLUs and replace the index used by exports and the local API.
+
+        Args:
+            mapping_rows (list): (plu, code, articul, name, price, unit_type) rows from format_data
+            replace (bool): True if the files were fully rewritten from these rows
+        """
+        if replace:
+            self.last_published = {}
+
+        for row in mapping_rows:
+            self.last_published[row[1]] = row
+
+        rows = tuple(sorted(self.last_published.values(), key=lambda row: row[0]))
+        self.index = PluIndex(rows, self.scales_statuses, updated=get_date())
+
+    def export_running(self) -> bool:
+        return self.export_thread is not None and self.export_thread.is_alive()
+
+    def start_export(self, filename: str) -> bool:
+        """
+        Export the current mapping in a background thread, so polling isn't blocked.
+
+        Returns:
+            bool: False if the previous export is still running
+        """
+        if self.export_running():
+            return False
+
+        self.export_thread = threading.Thread(target=self.export_mapping, args=(self.index.rows, filename),
+                                              name="plu-export", daemon=True)
+        self.export_thread.start()
+        return True
+
+    def export_mapping(self, rows: tuple, filename: str):
+        started = time.perf_counter()
+        try:
+            export_rows(rows, filename, header=MAPPING_EXPORT_HEADER)
+        except Exception as e:
+            write_log_file(f"Error exporting PLUs to '{filename}': {e}")
+        else:
+            write_log_file(f"{len(rows)} PLUs was exported to '{filename}' in {time.perf_counter() - started:.2f} s")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Save PLUs from REGOS into files for Shtrih-Print scales.")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="log import time of every module and the time until the first completed sync")
+    # Unknown arguments are ignored, as before the parser was added
+    return parser.parse_known_args()[0]
+
+def update_api(api_server, settings: Settings, save_data: SaveDataToTXT):
+    # api.py is imported only when the API is enabled, it isn't needed for the sync
+    if not settings.api["active"] and api_server is None:
+        return None
+    from api import update_api_server
+    return update_api_server(api_server, settings, save_data)
+
 def main():
-    save_data = SaveDataToTXT()
+    parse_args()
+    init_logging()
+    profile = startup_profile
+    if profile:
+        profile.mark("imports done")
+
+    try:
+        settings = Settings.from_dict(configure_settings())
+    except ValueError as e:
+        write_log_file(f"Error: invalid config.json: {e}")
+        raise SystemExit(1)
+
+    config_watcher = ConfigWatcher(settings)
+    save_data = SaveDataToTXT(settings)
+    api_server = update_api(None, settings, save_data)
     save_data.connect_fdb()
+    if profile:
+        profile.mark("connected to the Firebird" if save_data.connection_status else "first connection attempt")
     while True:
+        new_settings = config_watcher.poll()
+        if new_settings:
+            save_data.apply_settings(new_settings)
+            api_server = update_api(api_server, new_settings, save_data)
+
         if not save_data.connection_status:
             save_data.connect_fdb()
         cash_status = save_data.check_cash_status()
-        if cash_status == 1:
-            save_data.save_to_txt()
-
-        time.sleep(check_time)
+        if cash_status == 1 or (cash_status == 2 and save_data.recompute_pending):
+            try:
+                saved = save_data.save_to_txt()
+            except Exception as e:
+                # Changes weren't marked as saved, they are fetched again on the next sync
+                write_log_file(f"Error saving PLUs: {e}")
+                saved = False
+            if saved and profile:
+                profile.mark("first sync completed")
+                profile.stop()
+                write_log_file(profile.report())
+                profile = None
+
+        if cash_status != 0 and save_data.failed_scales:
+            try:
+                save_data.retry_failed_scales()
+            except Exception as e:
+                write_log_file(f"Error retrying failed scales: {e}")
+
+        if not save_data.export_running():
+            export_filename = read_export_request()
+            if export_filename:
+                save_data.start_export(export_filename)
+
+        time.sleep(save_data.settings.check_time)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,115 @@
+import sys
+import time
+from importlib.abc import Loader, MetaPathFinder
+
+# Only the standard library is imported here: the profile is started before the rest of save.py imports.
+
+
+class _TimingLoader(Loader):
+    """
+    Wrap a module loader and report the time spent creating and executing the module.
+    Everything else is delegated to the original loader.
+    """
+    def __init__(self, loader, name, profile):
+        self.loader = loader
+        self.name = name
+        self.profile = profile
+
+    def create_module(self, spec):
+        create_module = getattr(self.loader, "create_module", None)
+        if create_module is None:
+            return None
+        self.profile.enter(self.name)
+        try:
+            return create_module(spec)
+        finally:
+            self.profile.leave()
+
+    def exec_module(self, module):
+        self.profile.enter(self.name)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profile.leave()
+
+    def __getattr__(self, item):
+        return getattr(self.loader, item)
+
+
+class _TimingFinder(MetaPathFinder):
+    def __init__(self, profile):
+        self.profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimingLoader(spec.loader, fullname, self.profile)
+        return spec
+
+
+class StartupProfile:
+    """
+    Measure import time of every module and the time until the first completed sync.
+    Times are counted from the creation of the object, i.e. from the start of save.py.
+    Unpacking of the PyInstaller --onefile archive happens before Python starts and is not included.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finder = _TimingFinder(self)
+        self.imports = {}  # module name: [total seconds, self seconds]
+        self.stack = []
+        self.events = []
+
+    def start(self):
+        if self.finder not in sys.meta_path:
+            sys.meta_path.insert(0, self.finder)
+
+    def stop(self):
+        if self.finder in sys.meta_path:
+            sys.meta_path.remove(self.finder)
+
+    def enter(self, name):
+        # [module name, start time, time spent importing nested modules]
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def leave(self):
+        name, start, children = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        timing = self.imports.setdefault(name, [0.0, 0.0])
+        timing[0] += elapsed
+        timing[1] += elapsed - children
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def mark(self, event):
+        self.events.append((event, time.perf_counter() - self.started))
+
+    def report(self, limit=30) -> str:
+        """
+        Build a text report: events and the slowest modules by self time.
+
+        Args:
+            limit (int): Number of modules to include. Defaults to 30
+
+        Returns:
+            str: Report text
+        """
+        lines = ["Startup profile:"]
+        for event, elapsed in self.events:
+            lines.append(f"  {elapsed * 1000:10.1f} ms  {event}")
+
+        total_imports = sum(timing[1] for timing in self.imports.values())
+        lines.append(f"Imported {len(self.imports)} modules in {total_imports * 1000:.1f} ms "
+                     f"(self ms / cumulative ms / module):")
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (total, own) in slowest[:limit]:
+            lines.append(f"  {own * 1000:10.1f} {total * 1000:10.1f}  {name}")
+        return "\n".join(lines)